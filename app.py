@@ -1,15 +1,34 @@
 # app.py
 import os
+import asyncio
 import sqlite3
-import json
+import csv
+import io
+import functools
+import re
+import queue
+import time
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 
-from flask import Flask, request, jsonify, render_template
+from quart import Quart, request, jsonify, render_template, make_response
+from quart.json.provider import JSONProvider
+import orjson
 from dotenv import load_dotenv
+import sqlglot
+from sqlglot import exp
 
 from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from langchain_google_genai import ChatGoogleGenerativeAI #, GoogleGenerativeAIEmbeddings (for bonus)
+from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
+from pydantic import BaseModel
+from google import genai
+from google.genai import types as genai_types
+
+import llm_cache
+import query_router
 
 # --- Configuration ---
 load_dotenv()
@@ -18,42 +37,108 @@ if not GOOGLE_API_KEY:
     raise ValueError("GOOGLE_API_KEY not found in .env file. Please set it.")
 
 DB_FILENAME = "data/office_rag.db" # Make sure this path is correct
+# Threads per worker process for blocking work (SQLite, embeddings); the DB pool is sized to match
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", "32"))
+
+# Initialize Quart app (Flask-compatible API with native async views, so the
+# Gemini calls and SQLite work of concurrent requests overlap on one event loop)
+app = Quart(__name__)
+
+class OrjsonProvider(JSONProvider):
+    """Routes jsonify() and request.get_json() through orjson, which is several times faster than stdlib json."""
+    option = orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=self.option, default=str).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
-# Initialize Flask app
-app = Flask(__name__)
+    def response(self, *args, **kwargs):
+        # Skip the bytes -> str -> bytes round trip of the default implementation
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, option=self.option, default=str), mimetype="application/json")
+
+app.json = OrjsonProvider(app)
+
+@app.before_serving
+async def configure_thread_pool():
+    """Sizes the executor behind asyncio.to_thread so every thread can hold a pooled DB connection."""
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=WORKER_THREADS))
 
 # Initialize LLM (Gemini Pro)
 # Make sure you are using a model that supports function calling or good structured output if needed.
 # For text-to-SQL, "gemini-pro" is generally capable.
-llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", google_api_key=GOOGLE_API_KEY, temperature=0.1)
+LLM_MODEL = "gemini-2.5-flash"
+LLM_TEMPERATURE = 0.1
+llm = ChatGoogleGenerativeAI(model=LLM_MODEL, google_api_key=GOOGLE_API_KEY, temperature=LLM_TEMPERATURE)
 # For more complex tasks or if gemini-pro struggles, you might try "gemini-1.5-pro-latest" or "gemini-1.0-pro"
 
+# Turning a handful of result rows into a sentence is easy; use the cheaper, faster model for it
+SYNTH_MODEL = "gemini-2.5-flash-lite"
+synth_llm = ChatGoogleGenerativeAI(model=SYNTH_MODEL, google_api_key=GOOGLE_API_KEY, temperature=LLM_TEMPERATURE)
+
+# Embeddings are only used by the semantic layer of the LLM response cache (see llm_cache.py)
+embeddings = GoogleGenerativeAIEmbeddings(model="models/gemini-embedding-001", google_api_key=GOOGLE_API_KEY)
+llm_cache.configure(embeddings=embeddings)
+
+# Native Gemini client, used for server-side context caching of the SQL Generator prompt prefix
+genai_client = genai.Client(api_key=GOOGLE_API_KEY)
+CONTEXT_CACHE_TTL_SECONDS = 3600
+CONTEXT_CACHE_MIN_TOKENS = 1024 # Gemini refuses to cache prompts smaller than this for 2.5 Flash
+
 # --- Database Utility Functions ---
+DB_POOL_SIZE = WORKER_THREADS
+# Idle read-only connections, reused across requests instead of paying open + PRAGMAs + close every time
+_READ_POOL = queue.Queue(maxsize=DB_POOL_SIZE)
+
 def get_db_connection():
-    """Establishes a connection to the SQLite database."""
-    conn = sqlite3.connect(DB_FILENAME)
+    """
+    Establishes a read-only connection to the SQLite database. The agents only ever read, so the
+    file is opened with mode=ro and query_only: hallucinated DDL/DML can't touch the data.
+    """
+    # Pooled connections are handed to worker threads (asyncio.to_thread), hence check_same_thread=False
+    conn = sqlite3.connect(f"{Path(DB_FILENAME).resolve().as_uri()}?mode=ro", uri=True, check_same_thread=False)
     conn.row_factory = sqlite3.Row # Access columns by name
     # Enable foreign key enforcement for this connection
     conn.execute("PRAGMA foreign_keys = ON;")
+    conn.execute("PRAGMA query_only = ON;")
+    conn.execute("PRAGMA temp_store = MEMORY;")
+    # Engine-level guard rail: statements that would write or change the schema fail to prepare
+    conn.set_authorizer(_read_only_authorizer)
     return conn
 
-def get_schema_description():
+_READ_ONLY_ACTIONS = {
+    sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION,
+    sqlite3.SQLITE_RECURSIVE, sqlite3.SQLITE_TRANSACTION
+}
+
+def _read_only_authorizer(action, arg1, arg2, db_name, trigger_name):
+    """sqlite3 authorizer callback that only allows reads (plus `PRAGMA table_info`, used for validation)."""
+    if action in _READ_ONLY_ACTIONS or (action == sqlite3.SQLITE_PRAGMA and arg1 == "table_info"):
+        return sqlite3.SQLITE_OK
+    return sqlite3.SQLITE_DENY
+
+@contextmanager
+def borrow():
     """
-    Retrieves the DDL (CREATE TABLE statements) for all tables in the database.
-    This serves as the 'Relevant Schema' for the SQL Generator Agent.
+    Borrows a connection from the pool and returns it afterwards. The pool fills lazily; if every
+    pooled connection is in use, a temporary one is opened and closed on return instead of waiting.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%';")
-    schema_rows = cursor.fetchall()
-    conn.close()
-    if not schema_rows:
-        return "Error: No tables found in the database."
-    
-    schema_ddl = "\n\n".join([row['sql'] for row in schema_rows if row['sql']])
-    
-    # Add hints about date columns for the LLM
-    date_hints = """
+    try:
+        conn = _READ_POOL.get_nowait()
+    except queue.Empty:
+        conn = get_db_connection()
+    try:
+        yield conn
+    finally:
+        try:
+            _READ_POOL.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+# Hints about date columns for the LLM, appended to the schema DDL
+DATE_HINTS = """
 -- Important Notes for SQL Generation:
 -- Dates in 'employees.hire_date' and 'customers.registration_date' are stored as TEXT in 'YYYY-MM-DD' format.
 -- Dates in 'orders.order_date' are stored as TEXT in 'YYYY-MM-DD HH:MM:SS' format.
@@ -64,29 +149,100 @@ def get_schema_description():
 -- `price_at_purchase` in `order_items` is the historical price; `unit_price` in `products` is the current price.
 -- `manager_id` in `employees` references `employees.employee_id`.
 """
-    return schema_ddl + "\n" + date_hints
-
 
-def execute_sql_query(sql_query):
+@functools.lru_cache(maxsize=1)
+def get_schema_description():
+    """
+    Retrieves the DDL (CREATE TABLE statements) for all tables in the database.
+    This serves as the 'Relevant Schema' for the SQL Generator Agent.
+    The schema is static at runtime, so the result is cached; call
+    `get_schema_description.cache_clear()` (or hit /reload_schema) to refresh it.
+    """
+    with borrow() as conn:
+        schema_rows = conn.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%';").fetchall()
+    if not schema_rows:
+        return "Error: No tables found in the database."
+    
+    schema_ddl = "\n\n".join([row['sql'] for row in schema_rows if row['sql']])
+    return schema_ddl + "\n" + DATE_HINTS
+
+
+@functools.lru_cache(maxsize=1)
+def get_table_columns():
+    """Returns {table_name: {column_names}} (lower-cased) for validating generated SQL. Cached like the schema."""
+    with borrow() as conn:
+        tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%';")]
+        return {
+            table.lower(): {row[1].lower() for row in conn.execute(f"PRAGMA table_info('{table}');")}
+            for table in tables
+        }
+
+@functools.lru_cache(maxsize=1)
+def get_product_categories():
+    """Distinct product categories, so template routing only fires for categories that exist. Cached like the schema."""
+    if "category" not in get_table_columns().get("products", ()):
+        return ()
+    with borrow() as conn:
+        return tuple(row[0] for row in conn.execute("SELECT DISTINCT category FROM products WHERE category IS NOT NULL;"))
+
+def route_question(question):
+    """Canned SQL for trivial questions (see query_router), checked against the live schema and categories."""
+    return query_router.route_question(question, get_table_columns(), get_product_categories())
+
+def validate_sql(sql_query):
+    """
+    Parses the generated SQL with sqlglot and rejects anything that is not a single read query or that
+    references unknown tables/columns, so bad generations fail before reaching SQLite.
+    Returns an error message, or None if the query looks valid.
+    """
+    try:
+        statements = [statement for statement in sqlglot.parse(sql_query, read="sqlite") if statement is not None]
+    except sqlglot.errors.ParseError as e:
+        return f"SQL Validation Error: could not parse the query ({e})"
+    if len(statements) != 1:
+        return "SQL Validation Error: expected exactly one SQL statement."
+    parsed = statements[0]
+    if not isinstance(parsed, exp.Query):
+        return f"SQL Validation Error: only SELECT queries are allowed, got {parsed.key.upper()}."
+
+    table_columns = get_table_columns()
+    cte_names = {cte.alias_or_name.lower() for cte in parsed.find_all(exp.CTE)}
+    for table in parsed.find_all(exp.Table):
+        if table.name.lower() not in table_columns and table.name.lower() not in cte_names:
+            return f"SQL Validation Error: unknown table '{table.name}'."
+
+    known_columns = set().union(*table_columns.values())
+    aliases = {alias.alias.lower() for alias in parsed.find_all(exp.Alias)}
+    aliases |= {column.name.lower() for table_alias in parsed.find_all(exp.TableAlias) for column in table_alias.columns} # e.g. WITH c(x)
+    for column in parsed.find_all(exp.Column):
+        name = column.name.lower()
+        # Quoted identifiers may be SQLite's double-quoted string literals; leave those to SQLite
+        if name == "*" or column.this.args.get("quoted") or name in known_columns or name in aliases:
+            continue
+        return f"SQL Validation Error: unknown column '{column.name}'."
+    return None
+
+def _dict_factory(cursor, row):
+    return dict(zip([column[0] for column in cursor.description], row))
+
+def execute_sql_query(sql_query, params=()):
     """
     Executes a SQL query against the database.
     This is the core function of the Retriever Agent.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute(sql_query)
-        rows = cursor.fetchall()
-        # Convert rows to list of dicts for JSON serialization
-        results = [dict(row) for row in rows]
-        conn.commit() # Important for INSERT/UPDATE/DELETE, though we expect mostly SELECTs
-        return results, None
-    except sqlite3.Error as e:
-        return None, f"SQLite Error: {e}"
-    except Exception as e:
-        return None, f"Execution Error: {e}"
-    finally:
-        conn.close()
+    with borrow() as conn:
+        cursor = conn.cursor()
+        # Build JSON-ready dicts straight from the raw tuples instead of sqlite3.Row + a dict() pass
+        cursor.row_factory = _dict_factory
+        try:
+            cursor.execute(sql_query, params)
+            return cursor.fetchall(), None
+        except sqlite3.Error as e:
+            return None, f"SQLite Error: {e}"
+        except Exception as e:
+            return None, f"Execution Error: {e}"
+        finally:
+            cursor.close()
 
 # --- Agent Definitions ---
 
@@ -94,7 +250,9 @@ def execute_sql_query(sql_query):
 # In this implementation, the Schema Agent's role is fulfilled by get_schema_description()
 
 # 2. SQL Generator Agent
-sql_generator_prompt_template = """
+# The prompt is split into an invariant prefix (schema, guidelines, few-shot examples; only the
+# dates change, once a day) and the per-request question, so the prefix can live in a Gemini cache.
+sql_generator_prefix_template = """
 You are an expert SQLite SQL query writer. Your task is to generate a valid SQLite SQL query
 based on the provided database schema and a natural language question.
 
@@ -132,37 +290,105 @@ SQL: SELECT product_name, unit_price FROM products WHERE category = 'Electronics
 
 Question: "Who are the top 3 highest paid employees?"
 SQL: SELECT first_name, last_name, salary FROM employees ORDER BY salary DESC LIMIT 3;
+"""
 
+sql_generator_question_template = """
 Question: {question}
 SQL:
 """
 
-def generate_sql_query(question: str, schema: str) -> str:
+sql_generator_prompt_template = sql_generator_prefix_template + sql_generator_question_template
+
+# Chains are stateless, so they are built once at import rather than per request
+sql_chain = PromptTemplate(
+    template=sql_generator_prompt_template,
+    input_variables=["schema", "question", "current_date", "current_year_yyyy", "last_year_yyyy"]
+) | llm | StrOutputParser()
+
+# State of the Gemini CachedContent holding the rendered prefix
+_sql_context_cache = {"fingerprint": None, "name": None, "valid_until": 0.0}
+_sql_context_cache_lock = asyncio.Lock()
+
+async def get_sql_context_cache(prefix: str):
+    """
+    Returns the name of a Gemini CachedContent holding `prefix`, creating or refreshing it when the
+    TTL runs out or the prefix (schema/date) changes. Returns None when the prefix is below Gemini's
+    minimum cacheable size or caching is unavailable, in which case the caller sends the full prompt.
+    """
+    prefix_fingerprint = llm_cache.fingerprint(prefix)
+    now = time.time()
+    async with _sql_context_cache_lock:
+        state = _sql_context_cache
+        if state["fingerprint"] == prefix_fingerprint and now < state["valid_until"]:
+            return state["name"]
+
+        # The previous cache is left to expire on its own: requests that just got its name may still be using it
+        state.update(fingerprint=prefix_fingerprint, name=None)
+        try:
+            token_count = (await genai_client.aio.models.count_tokens(model=LLM_MODEL, contents=prefix)).total_tokens
+            if token_count < CONTEXT_CACHE_MIN_TOKENS:
+                # Too small to cache; don't ask again until the prefix changes
+                state["valid_until"] = float("inf")
+                return None
+            cache = await genai_client.aio.caches.create(
+                model=LLM_MODEL,
+                config=genai_types.CreateCachedContentConfig(
+                    display_name="sql-generator-prefix",
+                    contents=[prefix],
+                    ttl=f"{CONTEXT_CACHE_TTL_SECONDS}s",
+                ),
+            )
+            state["name"] = cache.name
+            # Refresh a minute early so we never reference an expired cache
+            state["valid_until"] = now + CONTEXT_CACHE_TTL_SECONDS - 60
+        except Exception as e:
+            app.logger.warning(f"Gemini context caching unavailable, sending full prompt: {e}")
+            state["valid_until"] = now + 300 # Retry in a few minutes
+            return None
+        return state["name"]
+
+# Leading ``` / ```sql (any case) and trailing ``` fences around the whole output
+_SQL_FENCE = re.compile(r"^\s*```(?:sql)?\s*|\s*```\s*$", re.IGNORECASE)
+
+def clean_sql(raw_sql):
+    """Cleans the output in case the LLM still adds ```sql ... ```"""
+    return _SQL_FENCE.sub("", raw_sql).strip()
+
+# The prompt renders today's date ("last year", "this month"), so cached SQL is only valid for that day.
+# Exact match only: "employees in Sales" and "employees in Marketing" embed as near-duplicates but need different SQL.
+@llm_cache.cached_call(
+    LLM_MODEL, LLM_TEMPERATURE, ttl_days=7,
+    extra_context=lambda: datetime.now().strftime("%Y-%m-%d"), semantic=False,
+)
+async def generate_sql_query(question: str, schema: str) -> str:
     """Generates SQL query using an LLM."""
     current_time = datetime.now()
-    prompt = PromptTemplate(
-        template=sql_generator_prompt_template,
-        input_variables=["schema", "question", "current_date", "current_year_yyyy", "last_year_yyyy"]
-    )
-    
-    sql_chain = prompt | llm | StrOutputParser()
-    
-    # Clean the output in case the LLM still adds ```sql ... ```
-    def clean_sql(raw_sql):
-        if raw_sql.strip().startswith("```sql"):
-            raw_sql = raw_sql.strip()[6:]
-        if raw_sql.strip().endswith("```"):
-            raw_sql = raw_sql.strip()[:-3]
-        return raw_sql.strip()
+    prompt_variables = {
+        "schema": schema,
+        "current_date": current_time.strftime("%Y-%m-%d"),
+        "current_year_yyyy": current_time.strftime("%Y"),
+        "last_year_yyyy": str(current_time.year - 1)
+    }
 
     try:
-        generated_sql = sql_chain.invoke({
-            "schema": schema,
-            "question": question,
-            "current_date": current_time.strftime("%Y-%m-%d"),
-            "current_year_yyyy": current_time.strftime("%Y"),
-            "last_year_yyyy": str(current_time.year - 1)
-        })
+        generated_sql = None
+        cached_content = await get_sql_context_cache(sql_generator_prefix_template.format(**prompt_variables))
+        if cached_content:
+            # Only the question is sent; the prefix is read from Gemini's context cache
+            try:
+                response = await genai_client.aio.models.generate_content(
+                    model=LLM_MODEL,
+                    contents=sql_generator_question_template.format(question=question),
+                    config=genai_types.GenerateContentConfig(cached_content=cached_content, temperature=LLM_TEMPERATURE),
+                )
+                generated_sql = response.text
+            except Exception as e:
+                # e.g. the cache expired or was deleted; retry once with the full prompt
+                app.logger.warning(f"Cached-context SQL generation failed, sending full prompt: {e}")
+                if _sql_context_cache["name"] == cached_content:
+                    _sql_context_cache["valid_until"] = 0 # Recreate on the next request
+        if generated_sql is None:
+            generated_sql = await sql_chain.ainvoke({**prompt_variables, "question": question})
         return clean_sql(generated_sql), None
     except Exception as e:
         return None, f"SQL Generation Error: {e}"
@@ -189,30 +415,46 @@ Important considerations:
 Natural Language Answer:
 """
 
-def synthesize_answer(question: str, sql_query: str, results, execution_error: str = None) -> str:
-    """Generates a natural language answer from SQL results using an LLM."""
-    prompt = PromptTemplate(
-        template=synthesizer_prompt_template,
-        input_variables=["question", "sql_query", "results"]
-    )
-    synthesis_chain = prompt | llm | StrOutputParser()
+synthesis_chain = PromptTemplate(
+    template=synthesizer_prompt_template,
+    input_variables=["question", "sql_query", "results"]
+) | synth_llm | StrOutputParser()
 
+def format_results_for_prompt(results, execution_error: str = None) -> str:
+    """
+    Renders SQL results (or the execution error) as compact text for the Synthesizer prompt:
+    `column = value` for a single aggregate, CSV (header + rows) for row lists.
+    """
     if execution_error:
-        results_str = f"An error occurred during SQL execution: {execution_error}"
-    elif results is None or (isinstance(results, list) and not results): # Check for None or empty list
-        results_str = "No matching records found."
-    else:
-        # Limit the number of rows displayed in the prompt to avoid exceeding token limits
-        max_rows_for_prompt = 20
-        if isinstance(results, list) and len(results) > max_rows_for_prompt:
-            results_str = json.dumps(results[:max_rows_for_prompt], indent=2) + \
-                          f"\n... (and {len(results) - max_rows_for_prompt} more rows)"
-        else:
-            results_str = json.dumps(results, indent=2)
-
+        return f"An error occurred during SQL execution: {execution_error}"
+    if results is None or (isinstance(results, list) and not results): # Check for None or empty list
+        return "No matching records found."
+    if not (isinstance(results, list) and isinstance(results[0], dict)):
+        return orjson.dumps(results, default=str).decode()
+
+    # Single aggregate value, e.g. from COUNT/SUM/AVG
+    if len(results) == 1 and len(results[0]) == 1:
+        (column, value), = results[0].items()
+        return f"{column} = {value}"
+
+    # Limit the number of rows displayed in the prompt to avoid exceeding token limits
+    max_rows_for_prompt = 20
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(results[0].keys())
+    writer.writerows(row.values() for row in results[:max_rows_for_prompt])
+    results_str = buffer.getvalue().rstrip("\n")
+    if len(results) > max_rows_for_prompt:
+        results_str += f"\n... (and {len(results) - max_rows_for_prompt} more rows)"
+    return results_str
+
+@llm_cache.cached_call(SYNTH_MODEL, LLM_TEMPERATURE, ttl_days=7)
+async def synthesize_answer(question: str, sql_query: str, results, execution_error: str = None) -> str:
+    """Generates a natural language answer from SQL results using an LLM."""
+    results_str = format_results_for_prompt(results, execution_error)
 
     try:
-        answer = synthesis_chain.invoke({
+        answer = await synthesis_chain.ainvoke({
             "question": question,
             "sql_query": sql_query,
             "results": results_str
@@ -221,21 +463,117 @@ def synthesize_answer(question: str, sql_query: str, results, execution_error: s
     except Exception as e:
         return None, f"Answer Synthesis Error: {e}"
 
+# 5. Batch variants of the SQL Generator and Synthesizer
+# Several questions are row-marshaled into one prompt, so the schema/guidelines/few-shot prefix
+# is paid once per batch instead of once per question. Past ~10 questions per prompt latency
+# grows faster than throughput, so larger requests are split into several batches.
+MAX_BATCH_SIZE = 10
+# Per request, and batches in flight per worker; keeps large requests under Gemini's per-minute rate limit
+MAX_BATCH_QUESTIONS = 50
+MAX_CONCURRENT_BATCHES = 2
+_batch_semaphore = asyncio.Semaphore(MAX_CONCURRENT_BATCHES)
+
+class BatchSQLItem(BaseModel):
+    id: int
+    sql: str
+
+class BatchSQL(BaseModel):
+    items: list[BatchSQLItem]
+
+class BatchAnswerItem(BaseModel):
+    id: int
+    answer: str
+
+class BatchAnswers(BaseModel):
+    items: list[BatchAnswerItem]
+
+batch_sql_generator_prompt_template = sql_generator_prefix_template + """
+Now write one SQL query for each of the numbered questions below, following the same guidelines.
+For every question return its number as `id` and the query as `sql`.
+
+{questions}
+"""
+
+batch_synthesizer_prompt_template = """
+You are an AI assistant that synthesizes human-readable answers from SQL query results.
+For each numbered item below (original question, generated SQL query and query results), provide a concise
+and natural language answer, following the same considerations for every item:
+- If the results are empty, state that no matching records were found or the query returned no data.
+- If there's an error in the results (e.g., an error message instead of data), mention the error.
+- If the results are a single number (e.g., from COUNT, SUM, AVG), state it clearly.
+- If the results are a list of items, summarize them or list a few if appropriate. Avoid just dumping a large table.
+- Be polite and helpful.
+For every item return its number as `id` and the answer as `answer`.
+
+{items}
+"""
+
+batch_sql_chain = PromptTemplate(
+    template=batch_sql_generator_prompt_template,
+    input_variables=["schema", "questions", "current_date", "current_year_yyyy", "last_year_yyyy"]
+) | llm.with_structured_output(BatchSQL)
+
+batch_synthesis_chain = PromptTemplate(
+    template=batch_synthesizer_prompt_template,
+    input_variables=["items"]
+) | synth_llm.with_structured_output(BatchAnswers)
+
+async def generate_sql_batch(questions: list, schema: str):
+    """Generates one SQL query per question with a single structured-output LLM call. Returns ({id: sql}, error)."""
+    current_time = datetime.now()
+    numbered_questions = "\n".join(f"Q{i}: {question}" for i, question in enumerate(questions, start=1))
+    try:
+        response = await batch_sql_chain.ainvoke({
+            "schema": schema,
+            "questions": numbered_questions,
+            "current_date": current_time.strftime("%Y-%m-%d"),
+            "current_year_yyyy": current_time.strftime("%Y"),
+            "last_year_yyyy": str(current_time.year - 1)
+        })
+        return {item.id: clean_sql(item.sql) for item in response.items}, None
+    except Exception as e:
+        return None, f"SQL Generation Error: {e}"
+
+async def synthesize_batch(items: list):
+    """
+    Generates answers for several (question, sql_query, results, execution_error) tuples with a
+    single structured-output LLM call. Returns ({id: answer}, error).
+    """
+    numbered_items = "\n\n".join(
+        f"Item {i}:\nOriginal Question: {question}\nGenerated SQL Query: {sql_query}\n"
+        f"Query Results:\n{format_results_for_prompt(results, execution_error)}"
+        for i, (question, sql_query, results, execution_error) in enumerate(items, start=1)
+    )
+    try:
+        response = await batch_synthesis_chain.ainvoke({"items": numbered_items})
+        return {item.id: item.answer for item in response.items}, None
+    except Exception as e:
+        return None, f"Answer Synthesis Error: {e}"
+
 
 # --- API Endpoint ---
 @app.route('/')
-def home():
+async def home():
     """Serves the simple HTML page for querying."""
-    return render_template('index.html')
-
-@app.route('/ask', methods=['POST'])
-def ask_question():
-    data = request.get_json()
-    if not data or 'question' not in data:
-        return jsonify({"error": "No question provided"}), 400
-    
-    question = data['question']
-    
+    return await render_template('index.html')
+
+@app.route('/reload_schema', methods=['POST'])
+async def reload_schema():
+    """Dev/admin helper: drops the cached schema so the next request re-reads the database."""
+    get_schema_description.cache_clear()
+    get_table_columns.cache_clear()
+    get_product_categories.cache_clear()
+    schema_desc = await asyncio.to_thread(get_schema_description)
+    if "Error:" in schema_desc:
+        return jsonify({"status": "error", "error_message": schema_desc}), 500
+    return jsonify({"status": "reloaded"}), 200
+
+async def answer_question(question: str, schema_task):
+    """
+    Runs the agent pipeline for one question and returns (response_dict, http_status).
+    `schema_task` is an awaitable for the schema description, started by the caller so the
+    (usually cached) schema lookup overlaps with request parsing.
+    """
     intermediate_steps = {}
     final_response = {
         "natural_language_answer": None,
@@ -245,40 +583,57 @@ def ask_question():
 
     try:
         # 1. Schema Agent: Get schema
-        schema_desc = get_schema_description()
+        schema_desc = await schema_task
         intermediate_steps["relevant_schema"] = schema_desc
         if "Error:" in schema_desc:
             final_response["error_message"] = schema_desc
-            return jsonify(final_response), 500
-
-        # 2. SQL Generator Agent: Generate SQL
-        generated_sql, sql_gen_error = generate_sql_query(question, schema_desc)
+            return final_response, 500
+
+        # 2. SQL Generator Agent: Generate SQL (trivial question shapes use canned SQL, no LLM call)
+        routed = await asyncio.to_thread(route_question, question)
+        if routed:
+            generated_sql, sql_gen_error = routed.sql, None
+            if routed.params:
+                intermediate_steps["sql_parameters"] = list(routed.params)
+        else:
+            generated_sql, sql_gen_error = await generate_sql_query(question, schema_desc)
         intermediate_steps["generated_sql_query"] = generated_sql
         if sql_gen_error:
             final_response["error_message"] = sql_gen_error
             # Try to synthesize an answer about the failure
-            nl_answer, _ = synthesize_answer(question, "Failed to generate SQL.", 
-                                             f"SQL Generation Error: {sql_gen_error}")
+            nl_answer, _ = await synthesize_answer(question, "Failed to generate SQL.", 
+                                                   f"SQL Generation Error: {sql_gen_error}")
             final_response["natural_language_answer"] = nl_answer or "Could not generate SQL due to an error."
-            return jsonify(final_response), 500
+            return final_response, 500
         if not generated_sql: # Should be caught by sql_gen_error, but as a safeguard
             final_response["error_message"] = "SQL generation failed to produce a query."
             final_response["natural_language_answer"] = "I apologize, I couldn't construct a database query for your question."
-            return jsonify(final_response), 500
-
-        # 3. Retriever Agent: Execute SQL
-        query_results, execution_error = execute_sql_query(generated_sql)
+            return final_response, 500
+
+        # 3. Retriever Agent: Validate, then execute SQL
+        validation_error = await asyncio.to_thread(validate_sql, generated_sql)
+        if validation_error:
+            # Fail fast: no point paying another LLM call to explain an invalid generation
+            intermediate_steps["result_rows"] = []
+            intermediate_steps["execution_error"] = validation_error
+            final_response["error_message"] = validation_error
+            final_response["natural_language_answer"] = "I apologize, I couldn't construct a valid query for your question."
+            return final_response, 500
+
+        query_results, execution_error = await asyncio.to_thread(
+            execute_sql_query, generated_sql, routed.params if routed else ()
+        )
         intermediate_steps["result_rows"] = query_results if query_results is not None else [] # Ensure it's a list for JSON
         
         if execution_error:
             intermediate_steps["execution_error"] = execution_error
             # Fallback for synthesis if execution fails
-            nl_answer, synth_error = synthesize_answer(question, generated_sql, None, execution_error)
+            nl_answer, synth_error = await synthesize_answer(question, generated_sql, None, execution_error)
             final_response["natural_language_answer"] = nl_answer or "There was an error executing the query."
             if synth_error:
                  final_response["natural_language_answer"] += f" (Synthesis also failed: {synth_error})"
             final_response["error_message"] = execution_error # Prioritize execution error message
-            return jsonify(final_response), 500
+            return final_response, 500
         
         # Handle "no matching records" explicitly if not an error
         if query_results is None or (isinstance(query_results, list) and not query_results):
@@ -286,26 +641,223 @@ def ask_question():
 
 
         # 4. Synthesizer Agent: Generate Natural Language Answer
-        natural_answer, synth_error = synthesize_answer(question, generated_sql, query_results)
+        local_answer = query_router.render_answer(routed, query_results[0]) if routed and query_results else None
+        if local_answer:
+            # Canned question with a canned answer: no LLM call at all
+            final_response["natural_language_answer"] = local_answer
+            return final_response, 200
+
+        natural_answer, synth_error = await synthesize_answer(question, generated_sql, query_results)
         final_response["natural_language_answer"] = natural_answer
         if synth_error:
             # If synthesis fails, provide raw results if available, or a fallback message
             final_response["natural_language_answer"] = (
                 f"Successfully retrieved data, but could not synthesize a natural answer (Error: {synth_error}). "
-                f"Query: {generated_sql}. Results: {json.dumps(query_results, indent=2) if query_results else 'No data.'}"
+                f"Query: {generated_sql}. Results: {orjson.dumps(query_results, default=str).decode() if query_results else 'No data.'}"
             )
             intermediate_steps["synthesis_error"] = synth_error
             # Still return 200 as we got data, but indicate synthesis issue
-            return jsonify(final_response), 200 
+            return final_response, 200 
 
 
-        return jsonify(final_response), 200
+        return final_response, 200
 
     except Exception as e:
         app.logger.error(f"An unexpected error occurred: {e}", exc_info=True)
         final_response["error_message"] = f"An unexpected system error occurred: {str(e)}"
         final_response["natural_language_answer"] = "I encountered an unexpected issue while processing your request."
-        return jsonify(final_response), 500
+        return final_response, 500
+
+# In-flight /ask pipelines keyed by normalized question, so identical concurrent questions share one run
+_inflight = {}
+
+@app.route('/ask', methods=['POST'])
+async def ask_question():
+    # 1. Schema Agent: start fetching the schema while the request body is parsed
+    schema_task = asyncio.create_task(asyncio.to_thread(get_schema_description))
+
+    data = await request.get_json()
+    if not isinstance(data, dict) or not (isinstance(data.get('question'), str) and data['question'].strip()):
+        schema_task.cancel()
+        return jsonify({"error": "No question provided"}), 400
+
+    key = llm_cache.make_key(data['question'], "/ask")
+    pipeline = _inflight.get(key)
+    if pipeline is None:
+        pipeline = asyncio.ensure_future(answer_question(data['question'], schema_task))
+        _inflight[key] = pipeline
+        pipeline.add_done_callback(lambda _: _inflight.pop(key, None))
+    else:
+        # Someone is already answering this exact question; wait for their result
+        schema_task.cancel()
+
+    # shield: a client disconnecting must not cancel the run other callers are waiting on
+    final_response, status = await asyncio.shield(pipeline)
+    return jsonify(final_response), status
+
+async def answer_batch(questions: list, schema_desc: str) -> list:
+    """Runs one batch (<= MAX_BATCH_SIZE questions) through the batched agents: 2 LLM calls in total."""
+    responses = [
+        {"question": question, "natural_language_answer": None, "intermediate_steps": {}, "error_message": None}
+        for question in questions
+    ]
+
+    # 2. SQL Generator Agent: one call for the whole batch
+    generated_sqls, sql_gen_error = await generate_sql_batch(questions, schema_desc)
+    if sql_gen_error:
+        for response in responses:
+            response["error_message"] = sql_gen_error
+            response["natural_language_answer"] = "Could not generate SQL due to an error."
+        return responses
+
+    # 3. Retriever Agent: execute the queries concurrently
+    async def execute(sql):
+        if not sql: # The LLM skipped this question
+            return None, "SQL generation failed to produce a query."
+        validation_error = await asyncio.to_thread(validate_sql, sql)
+        if validation_error:
+            return None, validation_error
+        return await asyncio.to_thread(execute_sql_query, sql)
+
+    sql_queries = [generated_sqls.get(i) for i in range(1, len(questions) + 1)]
+    executions = await asyncio.gather(*[execute(sql) for sql in sql_queries])
+    for response, sql, (query_results, execution_error) in zip(responses, sql_queries, executions):
+        steps = response["intermediate_steps"]
+        steps["generated_sql_query"] = sql
+        steps["result_rows"] = query_results if query_results is not None else []
+        if execution_error:
+            steps["execution_error"] = execution_error
+            response["error_message"] = execution_error
+        elif not query_results:
+            steps["execution_message"] = "No matching records found."
+
+    # 4. Synthesizer Agent: one call for the whole batch
+    answers, synth_error = await synthesize_batch([
+        (question, sql or "Failed to generate SQL.", query_results, execution_error)
+        for question, sql, (query_results, execution_error) in zip(questions, sql_queries, executions)
+    ])
+    for i, response in enumerate(responses, start=1):
+        if synth_error:
+            response["intermediate_steps"]["synthesis_error"] = synth_error
+        response["natural_language_answer"] = (answers or {}).get(i) or (
+            "There was an error executing the query." if response["error_message"]
+            else "Successfully retrieved data, but could not synthesize a natural answer."
+        )
+    return responses
+
+@app.route('/ask_batch', methods=['POST'])
+async def ask_batch():
+    """Answers several questions at once; each batch of up to MAX_BATCH_SIZE questions costs two LLM calls."""
+    schema_task = asyncio.create_task(asyncio.to_thread(get_schema_description))
+
+    data = await request.get_json()
+    questions = data.get('questions') if isinstance(data, dict) else None
+    if not questions or not isinstance(questions, list) or not all(isinstance(q, str) and q.strip() for q in questions):
+        schema_task.cancel()
+        return jsonify({"error": "Provide a non-empty list of questions"}), 400
+    if len(questions) > MAX_BATCH_QUESTIONS:
+        schema_task.cancel()
+        return jsonify({"error": f"At most {MAX_BATCH_QUESTIONS} questions per request"}), 400
+
+    try:
+        schema_desc = await schema_task
+        if "Error:" in schema_desc:
+            return jsonify({"answers": [], "relevant_schema": schema_desc, "error_message": schema_desc}), 500
+
+        batches = [questions[i:i + MAX_BATCH_SIZE] for i in range(0, len(questions), MAX_BATCH_SIZE)]
+        async def run(batch):
+            async with _batch_semaphore:
+                return await answer_batch(batch, schema_desc)
+
+        batch_responses = await asyncio.gather(*[run(batch) for batch in batches])
+        return jsonify({
+            "answers": [response for batch in batch_responses for response in batch],
+            "relevant_schema": schema_desc,
+            "error_message": None
+        }), 200
+    except Exception as e:
+        app.logger.error(f"An unexpected error occurred: {e}", exc_info=True)
+        return jsonify({"answers": [], "error_message": f"An unexpected system error occurred: {str(e)}"}), 500
+
+async def stream_answer(question: str, schema_task):
+    """
+    Streaming variant of answer_question: yields (event, payload) pairs as each agent finishes,
+    then the Synthesizer's answer token by token. Ends with a `done` event, or an `error_message`
+    event if a step fails (errors are reported as-is, without an extra LLM call to explain them).
+    """
+    try:
+        # 1. Schema Agent
+        schema_desc = await schema_task
+        yield "schema", schema_desc
+        if "Error:" in schema_desc:
+            yield "error_message", schema_desc
+            return
+
+        # 2. SQL Generator Agent (or canned SQL for trivial questions)
+        routed = await asyncio.to_thread(route_question, question)
+        if routed:
+            generated_sql, sql_gen_error = routed.sql, None
+        else:
+            generated_sql, sql_gen_error = await generate_sql_query(question, schema_desc)
+        yield "sql", {"generated_sql_query": generated_sql, "sql_parameters": list(routed.params) if routed else []}
+        if sql_gen_error or not generated_sql:
+            yield "error_message", sql_gen_error or "SQL generation failed to produce a query."
+            return
+
+        # 3. Retriever Agent
+        validation_error = await asyncio.to_thread(validate_sql, generated_sql)
+        if validation_error:
+            yield "error_message", validation_error
+            return
+        query_results, execution_error = await asyncio.to_thread(
+            execute_sql_query, generated_sql, routed.params if routed else ()
+        )
+        yield "rows", {"result_rows": query_results or [], "execution_error": execution_error}
+        if execution_error:
+            yield "error_message", execution_error
+            return
+
+        # 4. Synthesizer Agent, streamed
+        local_answer = query_router.render_answer(routed, query_results[0]) if routed and query_results else None
+        if local_answer:
+            yield "token", local_answer
+        else:
+            async for chunk in synthesis_chain.astream({
+                "question": question,
+                "sql_query": generated_sql,
+                "results": format_results_for_prompt(query_results)
+            }):
+                yield "token", chunk
+        yield "done", None
+
+    except Exception as e:
+        app.logger.error(f"An unexpected error occurred: {e}", exc_info=True)
+        yield "error_message", f"An unexpected system error occurred: {str(e)}"
+
+@app.route('/ask_stream', methods=['GET'])
+async def ask_stream():
+    """
+    Server-Sent Events version of /ask (GET, so the browser's EventSource can consume it).
+    Intermediate steps arrive as they complete and the answer streams in, so the user waits for the
+    first token instead of the whole generation.
+    """
+    question = request.args.get('question', '').strip()
+    if not question:
+        return jsonify({"error": "No question provided"}), 400
+
+    schema_task = asyncio.create_task(asyncio.to_thread(get_schema_description))
+
+    async def events():
+        async for event, payload in stream_answer(question, schema_task):
+            yield f"event: {event}\ndata: {app.json.dumps(payload)}\n\n".encode("utf-8")
+
+    response = await make_response(events(), 200, {
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no", # Don't let reverse proxies buffer the stream
+    })
+    response.timeout = None # The stream ends when the answer is complete
+    return response
 
 if __name__ == '__main__':
     # Ensure the data directory and db file exist.
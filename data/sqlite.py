@@ -2,6 +2,7 @@
 import sqlite3
 from faker import Faker
 import random
+from multiprocessing import Pool
 from datetime import datetime, timedelta # Still useful for Faker
 import os
 from dotenv import load_dotenv
@@ -18,6 +19,10 @@ NUM_CUSTOMERS = 200
 NUM_PRODUCTS = 100
 NUM_ORDERS = 500
 
+# Row generation (Faker is pure-Python and slow) is spread over worker processes once a table
+# is at least this big; below it, starting the pool costs more than it saves.
+PARALLEL_ROW_THRESHOLD = 1000
+
 DEPARTMENTS = ["Sales", "Marketing", "Engineering", "HR", "Support", "Finance"]
 JOB_TITLES_PER_DEPT = {
     "Sales": ["Sales Manager", "Sales Representative", "Account Executive"],
@@ -105,69 +110,119 @@ def create_tables(conn):
     conn.commit()
     cur.close()
 
+def create_indexes(conn):
+    """
+    Indexes the join/filter columns that generated SQL uses most (FK joins, department/category/date filters),
+    then refreshes the planner statistics so SQLite actually picks them.
+    """
+    cur = conn.cursor()
+    cur.executescript("""
+    CREATE INDEX IF NOT EXISTS idx_orders_customer ON orders(customer_id);
+    CREATE INDEX IF NOT EXISTS idx_orders_employee ON orders(employee_id);
+    CREATE INDEX IF NOT EXISTS idx_orders_date ON orders(order_date);
+    CREATE INDEX IF NOT EXISTS idx_oi_order ON order_items(order_id);
+    CREATE INDEX IF NOT EXISTS idx_oi_product ON order_items(product_id);
+    CREATE INDEX IF NOT EXISTS idx_emp_dept ON employees(department);
+    CREATE INDEX IF NOT EXISTS idx_prod_cat ON products(category);
+    ANALYZE;
+    """)
+    print("Indexes created successfully for SQLite.")
+    conn.commit()
+    cur.close()
+
+# --- Row generators (run in worker processes for large tables) ---
+def _init_worker():
+    # Forked workers inherit the parent's random state; reseed so they don't all produce the same rows
+    random.seed()
+    Faker.seed(random.getrandbits(64))
+
+def _unique_email(first_name, last_name, i):
+    # `fake.unique` only tracks values within one process, so uniqueness comes from the row index instead
+    return f"{first_name}.{last_name}{i}@{fake.free_email_domain()}".lower()
+
+def _gen_employee_row(i):
+    dept = random.choice(DEPARTMENTS)
+    job_title = random.choice(JOB_TITLES_PER_DEPT[dept])
+    salary_base = 50000
+    if "Manager" in job_title: salary_base += 30000
+    if "Senior" in job_title or "Lead" in job_title: salary_base += 20000
+    if dept == "Engineering": salary_base += 10000
+    if dept == "Sales": salary_base += 5000
+
+    first_name, last_name = fake.first_name(), fake.last_name()
+    return (
+        first_name, last_name, _unique_email(first_name, last_name, i), fake.phone_number(),
+        fake.date_between(start_date='-5y', end_date='today').isoformat(),
+        job_title, dept, round(random.uniform(salary_base*0.8, salary_base*1.2), 2)
+    )
+
+def _gen_customer_row(i):
+    first_name, last_name = fake.first_name(), fake.last_name()
+    return (
+        first_name, last_name, _unique_email(first_name, last_name, i), fake.phone_number(),
+        fake.street_address(), fake.city(), fake.state_abbr(), fake.zipcode(),
+        fake.date_between(start_date='-3y', end_date='today').isoformat()
+    )
+
+def _gen_product_row(i):
+    return (
+        fake.catch_phrase(), # MODIFIED LINE
+        random.choice(PRODUCT_CATEGORIES),
+        round(random.uniform(5.0, 500.0), 2),
+        random.randint(0, 1000)
+    )
+
+def generate_rows(row_generator, num_rows):
+    """Builds `num_rows` tuples with `row_generator(i)`, in a process pool for large tables."""
+    if num_rows < PARALLEL_ROW_THRESHOLD:
+        return [row_generator(i) for i in range(num_rows)]
+    with Pool(initializer=_init_worker) as pool:
+        return pool.map(row_generator, range(num_rows), chunksize=max(1, num_rows // (4 * (os.cpu_count() or 1))))
+
 def insert_employees(conn, num_employees):
     cur = conn.cursor()
-    employee_ids = []
     
-    employee_data_to_insert = []
-    for _ in range(num_employees):
-        dept = random.choice(DEPARTMENTS)
-        job_title = random.choice(JOB_TITLES_PER_DEPT[dept])
-        salary_base = 50000
-        if "Manager" in job_title: salary_base += 30000
-        if "Senior" in job_title or "Lead" in job_title: salary_base += 20000
-        if dept == "Engineering": salary_base += 10000
-        if dept == "Sales": salary_base += 5000
-
-        employee_data_to_insert.append((
-            fake.first_name(), fake.last_name(), fake.unique.email(), fake.phone_number(),
-            fake.date_between(start_date='-5y', end_date='today').isoformat(),
-            job_title, dept, round(random.uniform(salary_base*0.8, salary_base*1.2), 2)
-        ))
-
-    for data in employee_data_to_insert:
-        cur.execute(
-            """
-            INSERT INTO employees (first_name, last_name, email, phone_number, hire_date, job_title, department, salary)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?);
-            """,
-            data
-        )
-        employee_ids.append(cur.lastrowid)
-
-    for emp_id_idx, emp_id in enumerate(employee_ids): # Use enumerate to avoid issues with modifying list while iterating (though not strictly necessary here)
-        # Avoid self-management and simplify manager assignment
-        potential_managers = [m_id for i, m_id in enumerate(employee_ids) if i != emp_id_idx]
-        if not potential_managers: continue
-
-        cur.execute("SELECT department FROM employees WHERE employee_id = ?", (emp_id,))
-        emp_dept_row = cur.fetchone()
-        if not emp_dept_row: continue 
-        emp_dept = emp_dept_row[0]
-        
-        cur.execute("""
-            SELECT employee_id FROM employees 
-            WHERE department = ? AND employee_id != ? AND job_title LIKE ?
-        """, (emp_dept, emp_id, '%Manager%'))
-        dept_managers = [row[0] for row in cur.fetchall()]
+    employee_data_to_insert = generate_rows(_gen_employee_row, num_employees)
+
+    cur.executemany(
+        """
+        INSERT INTO employees (first_name, last_name, email, phone_number, hire_date, job_title, department, salary)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?);
+        """,
+        employee_data_to_insert
+    )
+    # Tables are freshly created, so generated IDs follow insertion order
+    cur.execute("SELECT employee_id FROM employees ORDER BY employee_id")
+    employee_ids = [row[0] for row in cur.fetchall()]
+
+    # Assign managers in Python: department/job title are already known for every employee,
+    # so there is no need to query them back one employee at a time.
+    managers_by_dept = {}
+    all_managers = []
+    for emp_id, data in zip(employee_ids, employee_data_to_insert):
+        job_title, dept = data[5], data[6]
+        if "manager" in job_title.lower(): # Same match as `job_title LIKE '%Manager%'`
+            managers_by_dept.setdefault(dept, []).append(emp_id)
+            all_managers.append(emp_id)
+
+    manager_updates = []
+    for emp_id, data in zip(employee_ids, employee_data_to_insert):
+        # Avoid self-management
+        dept_managers = [m_id for m_id in managers_by_dept.get(data[6], []) if m_id != emp_id]
+        other_managers = [m_id for m_id in all_managers if m_id != emp_id]
 
         manager_id = None
         if dept_managers:
             manager_id = random.choice(dept_managers)
-        else:
-            cur.execute("SELECT employee_id FROM employees WHERE employee_id != ? AND job_title LIKE ?", (emp_id, '%Manager%'))
-            all_managers = [row[0] for row in cur.fetchall()]
-            if all_managers:
-                manager_id = random.choice(all_managers)
-            else:
-                if potential_managers: # Only assign if there are others
-                    manager_id = random.choice(potential_managers)
-        
+        elif other_managers:
+            manager_id = random.choice(other_managers)
+        elif len(employee_ids) > 1: # Only assign if there are others
+            manager_id = random.choice([m_id for m_id in employee_ids if m_id != emp_id])
+
         if manager_id:
-            cur.execute(
-                "UPDATE employees SET manager_id = ? WHERE employee_id = ?",
-                (manager_id, emp_id)
-            )
+            manager_updates.append((manager_id, emp_id))
+
+    cur.executemany("UPDATE employees SET manager_id = ? WHERE employee_id = ?", manager_updates)
 
     print(f"{num_employees} employees inserted.")
     conn.commit()
@@ -176,20 +231,16 @@ def insert_employees(conn, num_employees):
 
 def insert_customers(conn, num_customers):
     cur = conn.cursor()
-    customer_ids = []
-    for _ in range(num_customers):
-        cur.execute(
-            """
-            INSERT INTO customers (first_name, last_name, email, phone_number, address, city, state, zip_code, registration_date)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);
-            """,
-            (
-                fake.first_name(), fake.last_name(), fake.unique.email(), fake.phone_number(),
-                fake.street_address(), fake.city(), fake.state_abbr(), fake.zipcode(),
-                fake.date_between(start_date='-3y', end_date='today').isoformat()
-            )
-        )
-        customer_ids.append(cur.lastrowid)
+    customer_data_to_insert = generate_rows(_gen_customer_row, num_customers)
+    cur.executemany(
+        """
+        INSERT INTO customers (first_name, last_name, email, phone_number, address, city, state, zip_code, registration_date)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);
+        """,
+        customer_data_to_insert
+    )
+    cur.execute("SELECT customer_id FROM customers ORDER BY customer_id")
+    customer_ids = [row[0] for row in cur.fetchall()]
     print(f"{num_customers} customers inserted.")
     conn.commit()
     cur.close()
@@ -197,21 +248,16 @@ def insert_customers(conn, num_customers):
 
 def insert_products(conn, num_products):
     cur = conn.cursor()
-    product_ids = []
-    for _ in range(num_products):
-        cur.execute(
-            """
-            INSERT INTO products (product_name, category, unit_price, stock_quantity)
-            VALUES (?, ?, ?, ?);
-            """,
-            (
-                fake.catch_phrase(), # MODIFIED LINE
-                random.choice(PRODUCT_CATEGORIES),
-                round(random.uniform(5.0, 500.0), 2),
-                random.randint(0, 1000)
-            )
-        )
-        product_ids.append(cur.lastrowid)
+    product_data_to_insert = generate_rows(_gen_product_row, num_products)
+    cur.executemany(
+        """
+        INSERT INTO products (product_name, category, unit_price, stock_quantity)
+        VALUES (?, ?, ?, ?);
+        """,
+        product_data_to_insert
+    )
+    cur.execute("SELECT product_id FROM products ORDER BY product_id")
+    product_ids = [row[0] for row in cur.fetchall()]
     print(f"{num_products} products inserted.")
     conn.commit()
     cur.close()
@@ -219,13 +265,14 @@ def insert_products(conn, num_products):
 
 def insert_orders_and_items(conn, num_orders, customer_ids, product_ids, employee_ids):
     cur = conn.cursor()
-    order_ids = []
     
     cur.execute("SELECT employee_id FROM employees WHERE department IN ('Sales', 'Support')")
     sales_employees = [row[0] for row in cur.fetchall()]
     if not sales_employees and employee_ids: # Added check for employee_ids
         sales_employees = employee_ids 
 
+    order_data_to_insert = []
+    products_per_order = []
     for _ in range(num_orders):
         if not customer_ids or not product_ids: # Ensure we have customers and products
             print("Skipping order creation due to lack of customers or products.")
@@ -239,37 +286,44 @@ def insert_orders_and_items(conn, num_orders, customer_ids, product_ids, employe
 
         status = random.choice(ORDER_STATUSES)
 
-        cur.execute(
-            """
-            INSERT INTO orders (customer_id, employee_id, order_date, status)
-            VALUES (?, ?, ?, ?);
-            """,
-            (customer_id, employee_id, order_date_str, status)
-        )
-        order_id = cur.lastrowid
-        order_ids.append(order_id)
+        order_data_to_insert.append((customer_id, employee_id, order_date_str, status))
 
         num_items_in_order = random.randint(1, 5)
         
         # Ensure we have enough unique products to sample from
         sample_size = min(num_items_in_order, len(product_ids))
-        if sample_size == 0: continue # Skip if no products to add
-
-        available_products_for_order = random.sample(product_ids, sample_size)
-
+        products_per_order.append(random.sample(product_ids, sample_size))
+
+    cur.executemany(
+        """
+        INSERT INTO orders (customer_id, employee_id, order_date, status)
+        VALUES (?, ?, ?, ?);
+        """,
+        order_data_to_insert
+    )
+    cur.execute("SELECT order_id FROM orders ORDER BY order_id")
+    order_ids = [row[0] for row in cur.fetchall()]
+
+    # Load every product's price once instead of looking it up per order item
+    cur.execute("SELECT product_id, unit_price FROM products")
+    prices = {product_id: unit_price for product_id, unit_price in cur.fetchall()}
+
+    # Accumulate every order's items and insert them in one go
+    order_item_data_to_insert = []
+    for order_id, available_products_for_order in zip(order_ids, products_per_order):
         for product_id in available_products_for_order:
-            cur.execute("SELECT unit_price FROM products WHERE product_id = ?", (product_id,))
-            price_row = cur.fetchone()
-            if price_row:
-                price_at_purchase = price_row[0]
+            if product_id in prices:
+                price_at_purchase = prices[product_id]
                 quantity = random.randint(1, 10)
-                cur.execute(
-                    """
-                    INSERT INTO order_items (order_id, product_id, quantity, price_at_purchase)
-                    VALUES (?, ?, ?, ?);
-                    """,
-                    (order_id, product_id, quantity, price_at_purchase)
-                )
+                order_item_data_to_insert.append((order_id, product_id, quantity, price_at_purchase))
+
+    cur.executemany(
+        """
+        INSERT INTO order_items (order_id, product_id, quantity, price_at_purchase)
+        VALUES (?, ?, ?, ?);
+        """,
+        order_item_data_to_insert
+    )
     print(f"{num_orders} orders and their items potentially inserted (check logs for skips).")
     conn.commit()
     cur.close()
@@ -282,12 +336,11 @@ if __name__ == "__main__":
 
     conn = None
     try:
-        # Faker's unique email generation needs to be "fresh" for each run if the DB is recreated.
-        # Instantiating Faker here ensures its internal state for `unique` is reset.
-        fake = Faker() # Re-initialize Faker here for fresh unique values if script is run multiple times
-
         conn = sqlite3.connect(DB_FILENAME)
         print(f"Connected to SQLite database: {DB_FILENAME}")
+        # Bulk load of a throwaway database: skip fsyncs and keep the rollback journal in memory
+        conn.execute("PRAGMA synchronous = OFF;")
+        conn.execute("PRAGMA journal_mode = MEMORY;")
 
         create_tables(conn)
         
@@ -300,6 +353,9 @@ if __name__ == "__main__":
         else:
             print("Skipping orders due to lack of customers, products, or employees to link from initial generation.")
 
+        # Built after the bulk load: one sort per index instead of updating it on every insert
+        create_indexes(conn)
+
         print("\nMock data generation complete for SQLite!")
 
     except sqlite3.Error as e:
@@ -0,0 +1,12 @@
+# gunicorn.conf.py
+# Production server: `gunicorn app:app` (this file is picked up automatically from the working directory).
+# Each /ask spends seconds waiting on Gemini, so every worker runs the async app on uvicorn's event loop
+# and overlaps many requests instead of blocking a whole process per request.
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:5001")
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+# Two sequential LLM calls can take a while; don't let gunicorn kill slow-but-healthy requests
+timeout = 120
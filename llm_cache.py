@@ -0,0 +1,277 @@
+# llm_cache.py
+"""
+Prompt/response cache that sits in front of the Gemini calls.
+
+Two levels, in the spirit of GPTCache:
+  1. Exact match on sha256(normalized question + call context), where the call
+     context covers the agent function, model, temperature and every other
+     argument (schema for the SQL Generator, SQL + results for the Synthesizer).
+  2. Semantic match: the question is embedded and compared (cosine similarity)
+     against cached questions with the same call context, so paraphrases like
+     "top customers" / "best customers" reuse the same entry.
+
+Entries live in a small SQLite database so they survive restarts; expired entries are deleted.
+"""
+import asyncio
+import functools
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+import orjson
+
+CACHE_DB_FILENAME = "data/llm_cache.db"
+SIMILARITY_THRESHOLD = 0.92
+# Seconds to wait on another worker's write lock before skipping the cache for this call
+LOCK_TIMEOUT = 1.0
+# Oldest entries beyond this many per call context are evicted on write
+MAX_ENTRIES_PER_CONTEXT = 1000
+# Questions mentioning these depend on the current date, which feeds the prompt
+VOLATILE_TOKENS = {"today", "now", "yesterday"}
+# Paraphrases that differ in one of these ("top 3" / "top five") are different questions
+NUMBER_WORDS = {
+    "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten",
+    "eleven", "twelve", "fifteen", "twenty", "fifty", "hundred", "thousand",
+}
+
+logger = logging.getLogger(__name__)
+
+_embeddings = None
+_store = None
+_store_lock = threading.Lock()
+
+
+def configure(embeddings=None, db_filename=None):
+    """Sets the embeddings model used for semantic matching and/or the cache file."""
+    global _embeddings, _store, CACHE_DB_FILENAME
+    _embeddings = embeddings
+    _embed_normalized.cache_clear()
+    if db_filename and db_filename != CACHE_DB_FILENAME:
+        CACHE_DB_FILENAME = db_filename
+        _store = None
+
+
+def normalize_question(question: str) -> str:
+    """Lower-cases, collapses whitespace and drops trailing punctuation."""
+    return re.sub(r"\s+", " ", question.strip().lower()).rstrip("?.! ")
+
+
+def is_volatile(question: str) -> bool:
+    """True if the answer depends on the current date, so it must not be cached."""
+    return any(token in VOLATILE_TOKENS for token in re.findall(r"[a-z]+", question.lower()))
+
+
+def fingerprint(value) -> str:
+    """Stable sha256 of any JSON-serializable value (falls back to str())."""
+    payload = orjson.dumps(value, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS, default=str)
+    return hashlib.sha256(payload).hexdigest()
+
+
+def literals(question: str) -> set:
+    """Numbers (digits or spelled out) and quoted strings in the question, e.g. {"2023", "'books'"}."""
+    normalized = normalize_question(question)
+    found = set(re.findall(r"'[^']*'|\"[^\"]*\"|\d+(?:\.\d+)?", normalized))
+    found.update(word for word in re.findall(r"[a-z]+", normalized) if word in NUMBER_WORDS)
+    return found
+
+
+def make_key(question: str, context: str) -> str:
+    """Exact-match cache key for a question within a call context."""
+    return hashlib.sha256(f"{normalize_question(question)}\x1f{context}".encode("utf-8")).hexdigest()
+
+
+class _ResponseStore:
+    """SQLite-backed key/value store plus an in-memory matrix of question embeddings."""
+
+    def __init__(self, db_filename):
+        self.conn = sqlite3.connect(db_filename, timeout=LOCK_TIMEOUT, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                context TEXT NOT NULL,
+                question TEXT NOT NULL,
+                value TEXT NOT NULL,
+                embedding BLOB,
+                ts REAL NOT NULL,
+                expires_at REAL
+            );
+        """)
+        if "expires_at" not in {row[1] for row in self.conn.execute("PRAGMA table_info(llm_cache);")}:
+            # Cache files from before expiry was stored; their rows count as expired and are purged below
+            self.conn.execute("ALTER TABLE llm_cache ADD COLUMN expires_at REAL;")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_expires ON llm_cache(expires_at);")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_context ON llm_cache(context, ts);")
+        self.conn.execute("DELETE FROM llm_cache WHERE expires_at IS NULL OR expires_at <= ?;", (time.time(),))
+        self.conn.commit()
+        self.lock = threading.Lock()
+        # context -> (list of keys, matrix of L2-normalized embeddings)
+        self.vectors = {}
+        for key, context, blob in self.conn.execute(
+            "SELECT key, context, embedding FROM llm_cache WHERE embedding IS NOT NULL;"
+        ):
+            self._add_vector(context, key, np.frombuffer(blob, dtype=np.float32))
+
+    def _add_vector(self, context, key, vector):
+        keys, matrix = self.vectors.get(context, ([], np.empty((0, vector.shape[0]), dtype=np.float32)))
+        if key in keys:
+            matrix[keys.index(key)] = vector
+        else:
+            keys.append(key)
+            matrix = np.vstack([matrix, vector])
+        self.vectors[context] = (keys, matrix)
+
+    def _remove_vectors(self, rows):
+        """Drops the embeddings of deleted (key, context) rows, and contexts left empty."""
+        by_context = {}
+        for key, context in rows:
+            by_context.setdefault(context, set()).add(key)
+        for context, removed in by_context.items():
+            if context not in self.vectors:
+                continue
+            keys, matrix = self.vectors[context]
+            keep = [i for i, key in enumerate(keys) if key not in removed]
+            if keep:
+                self.vectors[context] = ([keys[i] for i in keep], matrix[keep])
+            else:
+                del self.vectors[context]
+
+    def get(self, key):
+        """Returns (value, original question) for a live entry, else None."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value, question FROM llm_cache WHERE key = ? AND expires_at > ?;", (key, time.time())
+            ).fetchone()
+        if row is None:
+            return None
+        return orjson.loads(row[0]), row[1]
+
+    def set(self, key, context, question, value, ttl_seconds, vector=None):
+        """Stores an entry, then evicts expired entries and the oldest beyond MAX_ENTRIES_PER_CONTEXT."""
+        blob = vector.tobytes() if vector is not None else None
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, context, question, value, embedding, ts, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?);",
+                (key, context, question, orjson.dumps(value, default=str).decode(), blob, now, now + ttl_seconds)
+            )
+            evicted = self.conn.execute(
+                "SELECT key, context FROM llm_cache WHERE expires_at <= ?;", (now,)
+            ).fetchall()
+            evicted += self.conn.execute(
+                "SELECT key, context FROM llm_cache WHERE context = ? ORDER BY ts DESC LIMIT -1 OFFSET ?;",
+                (context, MAX_ENTRIES_PER_CONTEXT)
+            ).fetchall()
+            self.conn.executemany("DELETE FROM llm_cache WHERE key = ?;", [(row[0],) for row in evicted])
+            self.conn.commit()
+            if vector is not None:
+                self._add_vector(context, key, vector)
+            self._remove_vectors(evicted)
+
+    def nearest(self, context, vector, threshold):
+        """Returns the key of the most similar cached question above `threshold`, if any."""
+        with self.lock:
+            keys, matrix = self.vectors.get(context, ([], None))
+            if not keys:
+                return None
+            similarities = matrix @ vector
+            best = int(np.argmax(similarities))
+            return keys[best] if similarities[best] >= threshold else None
+
+
+def _get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = _ResponseStore(CACHE_DB_FILENAME)
+        return _store
+
+
+@functools.lru_cache(maxsize=256)
+def _embed_normalized(text):
+    vector = np.asarray(_embeddings.embed_query(text), dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else None
+
+
+def _embed(question):
+    """
+    Embeds the normalized question; returns None if no embeddings model is configured or the call fails.
+    Memoised, since the SQL Generator and Synthesizer look up the same question back to back.
+    """
+    if _embeddings is None:
+        return None
+    try:
+        return _embed_normalized(normalize_question(question))
+    except Exception:
+        return None
+
+
+def _lookup(question, context, key, semantic=True):
+    """Blocking cache lookup; returns (cached value or None, question embedding for storing a miss)."""
+    store = _get_store()
+
+    # 1. Exact match
+    entry = store.get(key)
+    if entry is not None:
+        return entry[0], None
+
+    if not semantic:
+        return None, None
+
+    # 2. Semantic match, only if both questions mention the same numbers and quoted values
+    vector = _embed(question)
+    if vector is not None:
+        similar_key = store.nearest(context, vector, SIMILARITY_THRESHOLD)
+        if similar_key is not None:
+            entry = store.get(similar_key)
+            if entry is not None and literals(entry[1]) == literals(question):
+                return entry[0], vector
+    return None, vector
+
+
+def cached_call(model: str, temperature: float, ttl_days: int = 7, extra_context=None, semantic: bool = True):
+    """
+    Decorator for agent coroutines shaped like `async fn(question, *args) -> (value, error)`.
+    Successful results are cached; errors and date-relative questions always go to the LLM.
+    `extra_context` is an optional zero-argument callable for prompt inputs that aren't arguments
+    (e.g. the current date); its result is part of the cache context.
+    `semantic=False` keeps only the exact-match level, for calls where a paraphrase check can't tell
+    that two similar questions need different answers.
+    """
+    ttl_seconds = ttl_days * 24 * 60 * 60
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(question, *args, **kwargs):
+            if is_volatile(question):
+                return await fn(question, *args, **kwargs)
+
+            extra = extra_context() if extra_context else None
+            context = fingerprint([fn.__name__, model, temperature, args, kwargs, extra])
+            key = make_key(question, context)
+
+            # SQLite work runs off the event loop; the cache file is shared by all workers and may be locked
+            try:
+                value, vector = await asyncio.to_thread(_lookup, question, context, key, semantic)
+            except sqlite3.Error as e:
+                logger.warning(f"LLM cache lookup failed, calling the model: {e}")
+                return await fn(question, *args, **kwargs)
+            if value is not None:
+                return value, None
+
+            value, error = await fn(question, *args, **kwargs)
+            if error is None and value:
+                try:
+                    await asyncio.to_thread(_get_store().set, key, context, question, value, ttl_seconds, vector)
+                except sqlite3.Error as e:
+                    logger.warning(f"LLM cache write failed: {e}")
+            return value, error
+
+        return wrapper
+
+    return decorator
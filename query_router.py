@@ -0,0 +1,86 @@
+# query_router.py
+"""
+Template-based SQL for trivially structured questions.
+
+A few question shapes ("how many customers?", "list products in the 'Books' category")
+map directly onto canned, parameterized SQL, so the SQL Generator LLM call can be skipped.
+Anything that doesn't match a rule exactly falls through to the full LLM pipeline.
+"""
+import re
+from typing import NamedTuple, Optional
+
+
+class RoutedQuery(NamedTuple):
+    sql: str
+    params: tuple
+    # Format string for answering locally from the single result row, or None to use the Synthesizer
+    answer_template: Optional[str] = None
+    # Used instead of answer_template when the row's count is 1
+    singular_template: Optional[str] = None
+
+
+# "how many customers", "how many orders do we have?", "count the employees", "number of products"
+_COUNT_PATTERN = re.compile(
+    r"^(?:how many|count(?: all)?(?: the)?|(?:what is )?the number of|number of)\s+([a-z][a-z_ ]*?)"
+    r"(?:\s+(?:do we have|are there|exist|in total|are in the database|in the database|total))?\s*[?.!]*$",
+    re.IGNORECASE,
+)
+
+# "list all products in the 'Electronics' category", "show products in category Home & Kitchen"
+_CATEGORY_PATTERN = re.compile(
+    r"^(?:list|show)(?: me)?(?: all)?(?: the)? products in(?: the)?(?: category)?\s+"
+    r"['\"]?([a-z0-9][a-z0-9 &\-]*?)['\"]?(?:\s+category)?\s*[?.!]*$",
+    re.IGNORECASE,
+)
+
+
+def _resolve_table(name: str, table_columns: dict) -> Optional[str]:
+    """Maps 'customers' / 'customer' / 'order items' onto an existing table name."""
+    name = re.sub(r"\s+", "_", name.strip().lower())
+    for candidate in (name, name + "s"):
+        if candidate in table_columns:
+            return candidate
+    return None
+
+
+def route_question(question: str, table_columns: dict, categories=()) -> Optional[RoutedQuery]:
+    """
+    Returns a RoutedQuery if the question matches one of the canned shapes, else None.
+    `table_columns` is the {table: {columns}} map of the live schema; rules only fire for tables that exist.
+    `categories` are the product categories in the database; the category rule only fires for one of them,
+    so "products in stock" or "products in Books and Toys" go to the SQL Generator instead.
+    """
+    question = question.strip()
+
+    match = _COUNT_PATTERN.match(question)
+    if match:
+        table = _resolve_table(match.group(1), table_columns)
+        if table:
+            noun = table.replace('_', ' ')
+            return RoutedQuery(
+                sql=f"SELECT COUNT(*) AS count FROM {table};",
+                params=(),
+                answer_template=f"There are {{count}} {noun}.",
+                singular_template=f"There is 1 {noun[:-1] if noun.endswith('s') else noun}.",
+            )
+
+    match = _CATEGORY_PATTERN.match(question)
+    if match and "category" in table_columns.get("products", ()):
+        # Use the stored spelling so the lookup is an exact match on the category index
+        category = {c.lower(): c for c in categories}.get(match.group(1).strip().lower())
+        if category:
+            return RoutedQuery(
+                sql="SELECT product_name, unit_price FROM products WHERE category = ?;",
+                params=(category,),
+            )
+
+    return None
+
+
+def render_answer(routed: RoutedQuery, row: dict) -> Optional[str]:
+    """The canned answer for the single result row, or None if the Synthesizer should answer."""
+    if not routed.answer_template:
+        return None
+    if routed.singular_template and row.get("count") == 1:
+        return routed.singular_template
+    return routed.answer_template.format(**row)